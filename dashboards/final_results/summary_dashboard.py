@@ -1,4 +1,9 @@
 import os
+import sys
+import functools
+import hashlib
+import json
+import struct
 import pandas as pd
 from IPython.display import display, HTML, Image
 import ipywidgets as widgets
@@ -10,33 +15,88 @@ BASE_DIR = os.path.abspath(r"C:\\Users\\hp\\Desktop\\Inventory-Optimization-Proj
 DATA_PATH = os.path.join(BASE_DIR, "data", "processed")
 EDA_PNG_PATH = os.path.join(BASE_DIR, "dashboards", "eda_results")
 SIM_PNG_PATH = os.path.join(BASE_DIR, "dashboards", "simulation_results")
+FINAL_RESULTS_PATH = os.path.join(BASE_DIR, "dashboards", "final_results")
+KPI_CACHE_PATH = os.path.join(FINAL_RESULTS_PATH, ".kpi_cache.json")
+KPI_HTML_PATH = os.path.join(FINAL_RESULTS_PATH, "dashboard_kpis.html")
+# Part of the KPI cache key: bump whenever compute_kpis() changes so cached KPIs
+# from the old code are not reused
+KPI_CACHE_VERSION = 1
+
+# Shared sku_kpis builder: consumers rebuild the table when it is missing or stale
+sys.path.append(os.path.join(BASE_DIR, "src", "reporting"))
+from build_sku_kpis import ensure_sku_kpis
 
 # -------------------------------------------------------------
 # 2️⃣ LOAD PROCESSED DATA
 # -------------------------------------------------------------
-def load_csv(file_name):
+# Per-SKU inventory aggregates come from sku_kpis.parquet (see ensure_sku_kpis below)
+KPI_FILES = ("sales.parquet", "sku_kpis.parquet", "purchase_orders.parquet")
+
+def file_mtime(file_name):
+    file_path = os.path.join(DATA_PATH, file_name)
+    return os.path.getmtime(file_path) if os.path.exists(file_path) else None
+
+# Cached per (file, mtime, columns): re-runs in the same session skip the read
+# until the processed file is rewritten
+@functools.lru_cache(maxsize=None)
+def _read_parquet_cached(file_name, mtime, columns):
     file_path = os.path.join(DATA_PATH, file_name)
-    return pd.read_csv(file_path) if os.path.exists(file_path) else pd.DataFrame()
+    return pd.read_parquet(file_path, columns=list(columns) if columns else None)
 
-products = load_csv("products.csv")
-sales = load_csv("sales.csv")
-inventory = load_csv("inventory_tx.csv")
-purchase_orders = load_csv("purchase_orders.csv")
-suppliers = load_csv("suppliers.csv")
-warehouses = load_csv("warehouses.csv")
+def load_parquet(file_name, columns=None):
+    mtime = file_mtime(file_name)
+    if mtime is None:
+        return pd.DataFrame()
+    return _read_parquet_cached(file_name, mtime, tuple(columns) if columns else None)
 
 # -------------------------------------------------------------
 # 3️⃣ PROCESS METRICS 
 # -------------------------------------------------------------
-sales['Sale_Date'] = pd.to_datetime(sales['Sale_Date']) if 'Sale_Date' in sales.columns else None
-purchase_orders['Order_Date'] = pd.to_datetime(purchase_orders['Order_Date']) if 'Order_Date' in purchase_orders.columns else None
-purchase_orders['Delivery_Date'] = pd.to_datetime(purchase_orders['Delivery_Date']) if 'Delivery_Date' in purchase_orders.columns else None
-inventory['Transaction_Date'] = pd.to_datetime(inventory['Transaction_Date']) if 'Transaction_Date' in inventory.columns else None
+# Memoized on the input file mtimes, so unchanged data is never re-aggregated
+@functools.lru_cache(maxsize=None)
+def compute_kpis(mtimes):
+    # Only the columns needed for the KPIs; dates are already datetime64 in Parquet
+    sales = load_parquet("sales.parquet", columns=['SKU', 'Quantity_Sold'])
+    sku_kpis = load_parquet("sku_kpis.parquet", columns=['SKU', 'Avg_On_Hand'])
+    purchase_orders = load_parquet("purchase_orders.parquet", columns=['Order_Date', 'Delivery_Date'])
+
+    # One group-by over sales gives both the SKU count and the per-SKU demand
+    sku_demand = sales.groupby('SKU', sort=False, observed=True)['Quantity_Sold'].mean() if 'Quantity_Sold' in sales.columns else pd.Series(dtype=float)
+
+    return {
+        'total_skus': len(sku_demand) if not sales.empty else 0,
+        'avg_weekly_demand': sku_demand.mean() if 'Quantity_Sold' in sales.columns else 0,
+        'avg_inventory': sku_kpis['Avg_On_Hand'].mean() if 'Avg_On_Hand' in sku_kpis.columns else 0,
+        'avg_supplier_lead': (purchase_orders['Delivery_Date'] - purchase_orders['Order_Date']).dt.days.mean() if ('Delivery_Date' in purchase_orders.columns and 'Order_Date' in purchase_orders.columns) else 0,
+    }
 
-total_skus = sales['SKU'].nunique() if not sales.empty else 0
-avg_weekly_demand = sales.groupby('SKU')['Quantity_Sold'].mean().mean() if 'Quantity_Sold' in sales.columns else 0
-avg_inventory = inventory.groupby('SKU')['Quantity'].mean().mean() if 'Quantity' in inventory.columns else 0
-avg_supplier_lead = (purchase_orders['Delivery_Date'] - purchase_orders['Order_Date']).dt.days.mean() if ('Delivery_Date' in purchase_orders.columns and 'Order_Date' in purchase_orders.columns) else 0
+# Persisted across runs: the KPIs are rebuilt only when an input file's mtime or
+# KPI_CACHE_VERSION changes
+def load_kpis():
+    mtimes = tuple(file_mtime(f) for f in KPI_FILES)
+    key = hashlib.blake2b(struct.pack("i", KPI_CACHE_VERSION)
+                          + b"".join(struct.pack("d", -1.0 if m is None else m) for m in mtimes)).hexdigest()
+    if os.path.exists(KPI_CACHE_PATH):
+        with open(KPI_CACHE_PATH) as f:
+            cached = json.load(f)
+        if cached.get('key') == key:
+            return cached['kpis']
+
+    kpis = compute_kpis(mtimes)
+    os.makedirs(FINAL_RESULTS_PATH, exist_ok=True)
+    with open(KPI_CACHE_PATH, 'w') as f:
+        json.dump({'key': key, 'kpis': kpis}, f)
+    return kpis
+
+# Rebuild a missing or stale sku_kpis table first, so its new mtime invalidates the KPI cache
+if file_mtime("inventory_tx.parquet") is not None:
+    ensure_sku_kpis(DATA_PATH)
+
+kpis = load_kpis()
+total_skus = kpis['total_skus']
+avg_weekly_demand = kpis['avg_weekly_demand']
+avg_inventory = kpis['avg_inventory']
+avg_supplier_lead = kpis['avg_supplier_lead']
 
 d = avg_weekly_demand * 52
 h = 1
@@ -76,9 +136,17 @@ cards_html = f"""
 </div>
 """
 
-display(HTML("<h2 style='color:#007acc;'>📊 Inventory Optimization Dashboard</h2>"))
+title_html = "<h2 style='color:#007acc;'>📊 Inventory Optimization Dashboard</h2>"
+
+display(HTML(title_html))
 display(HTML(cards_html))
 
+# The cards are plain HTML, so the exported KPI snapshot is written as-is
+# instead of being re-rendered into an image
+os.makedirs(FINAL_RESULTS_PATH, exist_ok=True)
+with open(KPI_HTML_PATH, 'w', encoding='utf-8') as f:
+    f.write(f"<!DOCTYPE html>\n<html><head><meta charset='utf-8'></head><body>\n{title_html}\n{cards_html}</body></html>\n")
+
 # -------------------------------------------------------------
 # 5️⃣ & 6️⃣ EDA and SIMULATION PNG SELECTION 
 # -------------------------------------------------------------
@@ -3,8 +3,19 @@
 # ============================================================
 
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import duckdb
 import pandas as pd
+import polars as pl
 import numpy as np
+import pyarrow.parquet as pq
+import matplotlib
+
+# Plots are only written to disk unless SHOW_PLOTS is set, so skip the GUI backend
+SHOW_PLOTS = bool(os.environ.get("SHOW_PLOTS"))
+if not SHOW_PLOTS:
+    matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import seaborn as sns
 
@@ -17,49 +28,159 @@ OUTPUT_DIR = os.path.join(BASE_DIR, "dashboards/eda_results")
 PLOT_DIR = OUTPUT_DIR
 os.makedirs(PLOT_DIR, exist_ok=True)
 
+# Shared sku_kpis builder: consumers rebuild the table when it is missing or stale
+sys.path.append(os.path.join(BASE_DIR, "src", "reporting"))
+from build_sku_kpis import ensure_sku_kpis
+
 print(f"📂 Using data from: {PROCESSED_PATH}")
 print(f"📂 Plots will be saved to: {PLOT_DIR}")
 
+# Headless runs encode PNGs on a background pool while the next plot is drawn
+save_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+save_futures = []  # checked after shutdown so a failed write still raises
+
+def save_plot(file_name):
+    path = os.path.join(PLOT_DIR, file_name)
+    if SHOW_PLOTS:
+        # plt.show() draws the same Figure, and savefig is not thread-safe
+        # against that, so save first on this thread
+        plt.gcf().savefig(path)
+        plt.show()
+    else:
+        save_futures.append(save_pool.submit(plt.gcf().savefig, path))
+
 # ------------------------------------------------------------
 # 2️⃣  LOAD DATA
 # ------------------------------------------------------------
-products = pd.read_csv(os.path.join(PROCESSED_PATH, "products.csv"))
-suppliers = pd.read_csv(os.path.join(PROCESSED_PATH, "suppliers.csv"))
-warehouses = pd.read_csv(os.path.join(PROCESSED_PATH, "warehouses.csv"))
-sales = pd.read_csv(os.path.join(PROCESSED_PATH, "sales.csv"))
-inventory = pd.read_csv(os.path.join(PROCESSED_PATH, "inventory_tx.csv"))
-purchase_orders = pd.read_csv(os.path.join(PROCESSED_PATH, "purchase_orders.csv"))
+# Lazy Polars scans: nothing is read until a query below is collected, and only
+# the selected columns are decoded (dates arrive as datetime64 from Parquet)
+products = pl.scan_parquet(os.path.join(PROCESSED_PATH, "products.parquet")).select(['SKU', 'Unit_Cost'])
+suppliers = pl.scan_parquet(os.path.join(PROCESSED_PATH, "suppliers.parquet")).select(['Supplier_ID', 'Supplier_Name', 'Lead_Time_Days_Avg'])
+warehouses = pl.scan_parquet(os.path.join(PROCESSED_PATH, "warehouses.parquet")).select(['Warehouse_ID', 'Location', 'Storage_Capacity_Units'])
+sales = pl.scan_parquet(os.path.join(PROCESSED_PATH, "sales.parquet")).select(['SKU', 'Sale_Date', 'Quantity_Sold'])
+inventory = pl.scan_parquet(os.path.join(PROCESSED_PATH, "inventory_tx.parquet")).select(['SKU', 'Warehouse_ID', 'Quantity'])
+
+# Per-SKU inventory aggregates (sku_kpis.parquet, rebuilt first if missing or stale)
+sku_kpis = pl.scan_parquet(ensure_sku_kpis(PROCESSED_PATH)).select(['SKU', 'Avg_On_Hand', 'Std_On_Hand', 'Min_On_Hand', 'Max_On_Hand'])
+purchase_orders = pl.scan_parquet(os.path.join(PROCESSED_PATH, "purchase_orders.parquet")).select(['Supplier_ID', 'Order_Date', 'Delivery_Date'])
+
+def file_shape(file_name):
+    # Shape of the whole file from its Parquet footer, not of the pruned scans above
+    meta = pq.read_metadata(os.path.join(PROCESSED_PATH, file_name))
+    return (meta.num_rows, meta.num_columns)
 
 # ------------------------------------------------------------
 # 3️⃣  BASIC DATA OVERVIEW
 # ------------------------------------------------------------
 print("\n--- Data Overview ---")
-print("Products:", products.shape)
-print("Suppliers:", suppliers.shape)
-print("Sales:", sales.shape)
-print("Inventory:", inventory.shape)
-print("Purchase Orders:", purchase_orders.shape)
+print("Products:", file_shape("products.parquet"))
+print("Suppliers:", file_shape("suppliers.parquet"))
+print("Sales:", file_shape("sales.parquet"))
+print("Inventory:", file_shape("inventory_tx.parquet"))
+print("Purchase Orders:", file_shape("purchase_orders.parquet"))
 
-print("\nSales columns:", sales.columns.tolist())
+sales_file = os.path.join(PROCESSED_PATH, "sales.parquet")
+print("\nSales columns:", pq.read_schema(sales_file).names)
 print("\nSample data:")
-print(sales.head())
-
-# Convert dates
-sales['Sale_Date'] = pd.to_datetime(sales['Sale_Date'])
-purchase_orders['Order_Date'] = pd.to_datetime(purchase_orders['Order_Date'])
-purchase_orders['Delivery_Date'] = pd.to_datetime(purchase_orders['Delivery_Date'])
-inventory['Transaction_Date'] = pd.to_datetime(inventory['Transaction_Date'])
+print(pl.read_parquet(sales_file, n_rows=5))
 
 # ------------------------------------------------------------
-# 4️⃣  DEMAND ANALYSIS PER SKU
+# 4️⃣  ANALYSIS QUERIES
 # ------------------------------------------------------------
-sales['Week'] = sales['Sale_Date'].dt.to_period('W')
-sku_weekly = sales.groupby(['SKU', 'Week'])['Quantity_Sold'].sum().reset_index()
+# The per-SKU and per-warehouse aggregates are lazy Polars queries over the scans
+# from section 2, collected together so they share each Parquet scan. The
+# join-heavy supplier and ABC analyses run as DuckDB SQL directly on the files.
+
+# Weekly demand per SKU (Monday-start weeks, same buckets as pandas' to_period('W'))
+sku_weekly = (
+    sales.with_columns(pl.col('Sale_Date').dt.truncate('1w').alias('Week'))
+    .group_by(['SKU', 'Week'])
+    .agg(pl.col('Quantity_Sold').sum())
+)
+
+sku_demand_stats_lf = (
+    sku_weekly.group_by('SKU')
+    .agg([
+        pl.col('Quantity_Sold').mean().alias('Avg_Weekly_Demand'),
+        pl.col('Quantity_Sold').std().alias('Std_Weekly_Demand'),
+        pl.len().alias('count'),
+    ])
+    .with_columns(
+        (pl.col('Std_Weekly_Demand') / pl.when(pl.col('Avg_Weekly_Demand') != 0).then(pl.col('Avg_Weekly_Demand'))).alias('CV')
+    )
+    .sort('SKU')
+)
+
+# On-hand inventory per SKU (pre-aggregated in sku_kpis.parquet)
+inv_summary_lf = sku_kpis.sort('SKU')
+
+# Compute storage capacity and current inventory per warehouse
+wh_plot_lf = (
+    warehouses.group_by('Warehouse_ID')
+    .agg([
+        pl.col('Storage_Capacity_Units').mean(),
+        pl.col('Location').first(),
+    ])
+    .join(inventory.group_by('Warehouse_ID').agg(pl.col('Quantity').cast(pl.Int64).sum()), on='Warehouse_ID', how='left')
+    .sort('Warehouse_ID')
+)
+
+# Single collect over all plans; pandas only for printing and plotting
+sku_demand_stats, inv_summary, wh_plot = [
+    df.to_pandas()
+    for df in pl.collect_all([sku_demand_stats_lf, inv_summary_lf, wh_plot_lf], engine='streaming')
+]
+
+con = duckdb.connect()
 
-sku_demand_stats = sku_weekly.groupby('SKU')['Quantity_Sold'].agg(['mean', 'std', 'count']).reset_index()
-sku_demand_stats.rename(columns={'mean': 'Avg_Weekly_Demand', 'std': 'Std_Weekly_Demand'}, inplace=True)
-sku_demand_stats['CV'] = sku_demand_stats['Std_Weekly_Demand'] / sku_demand_stats['Avg_Weekly_Demand'].replace(0, np.nan)
+# Actual vs promised supplier lead times
+supplier_perf = con.execute("""
+    SELECT po.Supplier_ID,
+           AVG(po.Actual_Lead_Time) AS Avg_Lead_Time,
+           STDDEV_SAMP(po.Actual_Lead_Time) AS Std_Lead_Time,
+           COUNT(*) AS count,
+           s.Supplier_Name,
+           s.Lead_Time_Days_Avg,
+           AVG(po.Actual_Lead_Time) - s.Lead_Time_Days_Avg AS Lead_Time_Diff
+    FROM (
+        SELECT Supplier_ID, date_diff('day', Order_Date, Delivery_Date) AS Actual_Lead_Time
+        FROM read_parquet($purchase_orders)
+    ) po
+    LEFT JOIN read_parquet($suppliers) s USING (Supplier_ID)
+    GROUP BY po.Supplier_ID, s.Supplier_Name, s.Lead_Time_Days_Avg
+    ORDER BY po.Supplier_ID
+""", {
+    'purchase_orders': os.path.join(PROCESSED_PATH, "purchase_orders.parquet"),
+    'suppliers': os.path.join(PROCESSED_PATH, "suppliers.parquet"),
+}).df()
 
+# ABC classification by annual sales value: A up to 80% cumulative value, B up to 95%, C above
+sku_value = con.execute("""
+    WITH sku_value AS (
+        -- Quantity widened so the product cannot overflow; the sum keeps Unit_Cost's precision
+        SELECT s.SKU, SUM(CAST(s.Quantity_Sold AS BIGINT) * p.Unit_Cost) AS Annual_Value
+        FROM read_parquet($sales) s
+        LEFT JOIN read_parquet($products) p USING (SKU)
+        GROUP BY s.SKU
+    ), cumulative AS (
+        SELECT SKU, Annual_Value,
+               SUM(Annual_Value) OVER (ORDER BY Annual_Value DESC, SKU ROWS UNBOUNDED PRECEDING)
+                   / SUM(Annual_Value) OVER () * 100 AS "Cumulative_%"
+        FROM sku_value
+    )
+    SELECT *,
+           CASE WHEN "Cumulative_%" <= 80 THEN 'A' WHEN "Cumulative_%" <= 95 THEN 'B' ELSE 'C' END AS Category
+    FROM cumulative
+    ORDER BY Annual_Value DESC, SKU
+""", {
+    'sales': os.path.join(PROCESSED_PATH, "sales.parquet"),
+    'products': os.path.join(PROCESSED_PATH, "products.parquet"),
+}).df()
+sku_value['Category'] = pd.Categorical(sku_value['Category'], categories=['A', 'B', 'C'])
+
+# ------------------------------------------------------------
+# 5️⃣  DEMAND ANALYSIS PER SKU
+# ------------------------------------------------------------
 print("\n--- SKU Demand Variability ---")
 print(sku_demand_stats.head())
 
@@ -70,15 +191,11 @@ plt.title("Demand Variability Across SKUs (Coefficient of Variation)")
 plt.xlabel("CV (Std / Mean of Weekly Demand)")
 plt.ylabel("Count of SKUs")
 plt.tight_layout()
-plt.savefig(os.path.join(PLOT_DIR, "demand_cv_hist.png"))
-plt.show()
+save_plot("demand_cv_hist.png")
 
 # ------------------------------------------------------------
-# 5️⃣  INVENTORY ANALYSIS
+# 6️⃣  INVENTORY ANALYSIS
 # ------------------------------------------------------------
-inv_summary = inventory.groupby('SKU')['Quantity'].agg(['mean', 'std', 'min', 'max']).reset_index()
-inv_summary.rename(columns={'mean':'Avg_On_Hand','std':'Std_On_Hand'}, inplace=True)
-
 # Visualize the distribution of average on-hand inventory
 plt.figure(figsize=(8,4))
 sns.histplot(inv_summary['Avg_On_Hand'], bins=30, color='orange', edgecolor='black')
@@ -86,19 +203,11 @@ plt.title('Average On-Hand Inventory Distribution (per SKU)')
 plt.xlabel('Average Quantity on Hand')
 plt.ylabel('Count of SKUs')
 plt.tight_layout()
-plt.savefig(os.path.join(PLOT_DIR, "avg_on_hand_inventory_hist.png"))
-plt.show()
+save_plot("avg_on_hand_inventory_hist.png")
 
 # ------------------------------------------------------------
-# 6️⃣  SUPPLIER PERFORMANCE ANALYSIS
+# 7️⃣  SUPPLIER PERFORMANCE ANALYSIS
 # ------------------------------------------------------------
-purchase_orders['Actual_Lead_Time'] = (purchase_orders['Delivery_Date'] - purchase_orders['Order_Date']).dt.days
-supplier_perf = purchase_orders.groupby('Supplier_ID')['Actual_Lead_Time'].agg(['mean','std','count']).reset_index()
-supplier_perf.rename(columns={'mean':'Avg_Lead_Time','std':'Std_Lead_Time'}, inplace=True)
-
-supplier_perf = pd.merge(supplier_perf, suppliers[['Supplier_ID','Supplier_Name','Lead_Time_Days_Avg']], on='Supplier_ID', how='left')
-supplier_perf['Lead_Time_Diff'] = supplier_perf['Avg_Lead_Time'] - supplier_perf['Lead_Time_Days_Avg']
-
 print("\n--- Supplier Performance ---")
 print(supplier_perf.head())
 
@@ -108,38 +217,11 @@ plt.title("Supplier Lead Time Difference (Actual vs Promised)")
 plt.xlabel("Lead Time Difference (days)")
 plt.ylabel("Count of Suppliers")
 plt.tight_layout()
-plt.savefig(os.path.join(PLOT_DIR, "supplier_lead_time_diff_hist.png"))
-plt.show()
+save_plot("supplier_lead_time_diff_hist.png")
 
 # ------------------------------------------------------------
-# 7️⃣  ABC CLASSIFICATION
+# 8️⃣  ABC CLASSIFICATION
 # ------------------------------------------------------------
-# Merge unit cost from products table
-sales_value = pd.merge(sales, products[['SKU', 'Unit_Cost']], on='SKU', how='left')
-
-# Calculate total sales value per row
-sales_value['Sales_Value'] = sales_value['Quantity_Sold'] * sales_value['Unit_Cost']
-
-# Aggregate to SKU level
-sku_value = (
-    sales_value.groupby('SKU', as_index=False)['Sales_Value']
-    .sum()
-    .rename(columns={'Sales_Value': 'Annual_Value'})
-)
-
-# Sort descending by annual value
-sku_value = sku_value.sort_values('Annual_Value', ascending=False).reset_index(drop=True)
-
-# Compute cumulative percentage
-sku_value['Cumulative_%'] = sku_value['Annual_Value'].cumsum() / sku_value['Annual_Value'].sum() * 100
-
-# Assign ABC category
-sku_value['Category'] = pd.cut(
-    sku_value['Cumulative_%'],
-    bins=[0, 80, 95, 100],
-    labels=['A', 'B', 'C']
-)
-
 # Plot top 20 SKUs
 top20 = sku_value.head(20)
 plt.figure(figsize=(10,6))
@@ -149,20 +231,13 @@ plt.ylabel('SKU')
 plt.title('Top 20 SKUs by Annual Sales Value (ABC Classification)')
 plt.gca().invert_yaxis()  # highest value on top
 plt.tight_layout()
-plt.savefig(os.path.join(PLOT_DIR, "abc_top20_skus.png"))
-plt.show()
+save_plot("abc_top20_skus.png")
 
 print(sku_value.head())
 
 # ------------------------------------------------------------
-# 8️⃣  WAREHOUSE-LEVEL INVENTORY ANALYSIS
+# 9️⃣  WAREHOUSE-LEVEL INVENTORY ANALYSIS
 # ------------------------------------------------------------
-# Compute storage capacity and current inventory per warehouse
-wh_capacity = warehouses.groupby('Warehouse_ID')['Storage_Capacity_Units'].mean().reset_index()
-wh_current = inventory.groupby('Warehouse_ID')['Quantity'].sum().reset_index()
-wh_plot = pd.merge(wh_capacity, wh_current, on='Warehouse_ID', how='left')
-wh_plot = pd.merge(wh_plot, warehouses[['Warehouse_ID','Location']], on='Warehouse_ID', how='left')
-
 # Plot capacity vs current stock
 plt.figure(figsize=(10,6))
 bar_width = 0.4
@@ -175,5 +250,10 @@ plt.ylabel('Units')
 plt.title('Warehouse Capacity vs Current Inventory')
 plt.legend()
 plt.tight_layout()
-plt.savefig(os.path.join(PLOT_DIR, "warehouse_capacity_vs_inventory.png"))
-plt.show()
+save_plot("warehouse_capacity_vs_inventory.png")
+
+# Wait for the queued PNGs before releasing the figures
+save_pool.shutdown(wait=True)
+for future in save_futures:
+    future.result()
+plt.close('all')
@@ -1,15 +1,56 @@
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
 
 RAW_PATH = "data/raw/"               #add appropriate raw data path
 PROCESSED_PATH = "data/processed/"   #add appropriate processed data path
 
+# Date columns per exported table, stored as datetime64[ns] so they round-trip through Parquet
+DATE_COLUMNS = {
+    "sales": ["Sale_Date"],
+    "inventory_tx": ["Transaction_Date"],
+    "purchase_orders": ["Order_Date", "Delivery_Date"],
+}
+
+# Low-cardinality key/label columns, stored dictionary-encoded (category dtype) so
+# downstream group-bys and joins hash small integer codes instead of strings
+CATEGORICAL_COLUMNS = ["SKU", "Warehouse_ID", "Supplier_ID", "Transaction_Type", "Status", "Category"]
+
+# Large tables are sorted on these keys and written with one row group per value of the
+# first key, so Parquet min/max statistics let filtered scans skip whole row groups
+CLUSTER_COLUMNS = {
+    "sales": ["Warehouse_ID", "SKU"],
+    "inventory_tx": ["Warehouse_ID", "SKU"],
+}
+
 def load_excel(file_name):
     path = os.path.join(RAW_PATH, file_name)
     df = pd.read_excel(path)
     print(f"✅ Loaded {file_name}: {df.shape[0]} rows, {df.shape[1]} columns")
     return df
 
+def downcast_numeric(df):
+    # int64 -> int32 (when the values fit) and float64 -> float32, so the processed
+    # tables carry half the bytes into every downstream scan and group-by
+    int32 = np.iinfo(np.int32)
+    for col in df.select_dtypes("int64").columns:
+        if df[col].between(int32.min, int32.max).all():
+            df[col] = df[col].astype("int32")
+    for col in df.select_dtypes("float64").columns:
+        df[col] = df[col].astype("float32")
+    return df
+
+def write_clustered_parquet(df, path, cluster_cols):
+    df = df.sort_values(cluster_cols, kind="stable", ignore_index=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    key = df[cluster_cols[0]]
+    bounds = np.flatnonzero(key.ne(key.shift())).tolist() + [len(df)]
+    with pq.ParquetWriter(path, table.schema, compression="snappy") as writer:
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            writer.write_table(table.slice(start, end - start))
+
 def validate_columns(df, expected_cols, name):
     missing = set(expected_cols) - set(df.columns)
     if missing:
@@ -63,8 +104,18 @@ def main():
         "inventory_tx": inventory,
         "purchase_orders": purchase
     }.items():
-        df.to_csv(os.path.join(PROCESSED_PATH, f"{name}.csv"), index=False)
-        print(f"📁 Saved {name}.csv")
+        for col in DATE_COLUMNS.get(name, []):
+            df[col] = pd.to_datetime(df[col]).astype("datetime64[ns]")
+        df = downcast_numeric(df)
+        for col in CATEGORICAL_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype("category")
+        path = os.path.join(PROCESSED_PATH, f"{name}.parquet")
+        if name in CLUSTER_COLUMNS:
+            write_clustered_parquet(df, path, CLUSTER_COLUMNS[name])
+        else:
+            df.to_parquet(path, engine="pyarrow", compression="snappy", index=False)
+        print(f"📁 Saved {name}.parquet")
 
 if __name__ == "__main__":
     main()
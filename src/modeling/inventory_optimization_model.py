@@ -3,8 +3,11 @@
 # ============================================================
 
 import os
+import sys
 import pandas as pd
+import polars as pl
 import numpy as np
+from numba import njit, prange
 import matplotlib.pyplot as plt
 import seaborn as sns
 
@@ -17,48 +20,65 @@ PROCESSED_PATH = os.path.join(BASE_DIR, "data/processed")
 OUTPUT_DIR = os.path.join(BASE_DIR, "dashboards/optimization_results/plots")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Shared sku_kpis builder: consumers rebuild the table when it is missing or stale
+sys.path.append(os.path.join(BASE_DIR, "src", "reporting"))
+from build_sku_kpis import ensure_sku_kpis
+
 print(f"📂 Saving optimization plots to: {OUTPUT_DIR}")
 
 # ------------------------------------------------------------
 # 2️⃣ LOAD DATA
 # ------------------------------------------------------------
-# We re-use cleaned processed data from earlier steps
-products = pd.read_csv(os.path.join(PROCESSED_PATH, "products.csv"))
-suppliers = pd.read_csv(os.path.join(PROCESSED_PATH, "suppliers.csv"))
-warehouses = pd.read_csv(os.path.join(PROCESSED_PATH, "warehouses.csv"))
-sales = pd.read_csv(os.path.join(PROCESSED_PATH, "sales.csv"))
-inventory = pd.read_csv(os.path.join(PROCESSED_PATH, "inventory_tx.csv"))
-purchase_orders = pd.read_csv(os.path.join(PROCESSED_PATH, "purchase_orders.csv"))
+# We re-use cleaned processed data from earlier steps (only the columns used below).
+# Products, sales and purchase orders are lazy Polars scans feeding the model_df plan.
+products = pl.scan_parquet(os.path.join(PROCESSED_PATH, "products.parquet")).select(['SKU', 'Supplier_ID'])
+sales = pl.scan_parquet(os.path.join(PROCESSED_PATH, "sales.parquet")).select(['SKU', 'Quantity_Sold'])
+purchase_orders = pl.scan_parquet(os.path.join(PROCESSED_PATH, "purchase_orders.parquet")).select(['Supplier_ID', 'Order_Date', 'Delivery_Date'])
+
+# Per-SKU inventory aggregates (sku_kpis.parquet, rebuilt first if missing or stale)
+current_inv = pd.read_parquet(ensure_sku_kpis(PROCESSED_PATH), columns=['SKU', 'Current_Stock'])
 
 # ------------------------------------------------------------
 # 3️⃣ PREPARE BASE DATAFRAME
 # ------------------------------------------------------------
+# The joins and default fills are one lazy Polars plan, collected once at the end of 3.
 # Aggregate sales demand stats per SKU
-sales['Sale_Date'] = pd.to_datetime(sales['Sale_Date'])
 sku_demand = (
-    sales.groupby('SKU')['Quantity_Sold']
-    .agg(['mean', 'std'])
-    .rename(columns={'mean': 'Avg_Weekly_Demand', 'std': 'Std_Weekly_Demand'})
-    .reset_index()
+    sales.group_by('SKU')
+    .agg([
+        pl.col('Quantity_Sold').mean().alias('Avg_Weekly_Demand'),
+        pl.col('Quantity_Sold').std().alias('Std_Weekly_Demand'),
+    ])
 )
 
+# Whole days between delivery and order as one int64 subtraction on the raw
+# datetime64[ns] values (see load_data.py), kept as int32
+NS_PER_DAY = 86_400_000_000_000
+lead_time_days = (
+    (pl.col('Delivery_Date').cast(pl.Int64) - pl.col('Order_Date').cast(pl.Int64)) // NS_PER_DAY
+).cast(pl.Int32)
+
 # Average supplier lead time per SKU (join via Supplier_ID if available)
-purchase_orders['Order_Date'] = pd.to_datetime(purchase_orders['Order_Date'])
-purchase_orders['Delivery_Date'] = pd.to_datetime(purchase_orders['Delivery_Date'])
-purchase_orders['Lead_Time_Days'] = (purchase_orders['Delivery_Date'] - purchase_orders['Order_Date']).dt.days
 lead_times = (
-    purchase_orders.groupby('Supplier_ID')['Lead_Time_Days']
-    .mean()
-    .reset_index()
-    .rename(columns={'Lead_Time_Days': 'Avg_Lead_Time'})
+    purchase_orders.with_columns(lead_time_days.alias('Lead_Time_Days'))
+    .group_by('Supplier_ID')
+    .agg(pl.col('Lead_Time_Days').mean().alias('Avg_Lead_Time'))
 )
 
-# Merge supplier lead times with product SKUs
-model_df = pd.merge(products, lead_times, on='Supplier_ID', how='left')
-model_df = pd.merge(model_df, sku_demand, on='SKU', how='left')
-
-# Fill missing with safe defaults
-model_df.fillna({'Avg_Weekly_Demand': 0, 'Std_Weekly_Demand': 0, 'Avg_Lead_Time': 7}, inplace=True)
+# Merge supplier lead times with product SKUs, filling missing with safe defaults
+model_lf = (
+    products.join(lead_times, on='Supplier_ID', how='left', maintain_order='left')
+    .join(sku_demand, on='SKU', how='left', maintain_order='left')
+    .with_columns([
+        pl.col('Avg_Weekly_Demand').fill_null(0),
+        pl.col('Std_Weekly_Demand').fill_null(0),
+        pl.col('Avg_Lead_Time').fill_null(7),
+    ])
+)
+model_df = model_lf.collect().to_pandas()
+# SKU is categorical in the Parquet files; plain strings keep the seaborn bar
+# plots from reserving an x slot for every unused category
+model_df['SKU'] = model_df['SKU'].astype(str)
 
 # ------------------------------------------------------------
 # 4️⃣ SAFETY STOCK & ROP CALCULATION
@@ -66,14 +86,25 @@ model_df.fillna({'Avg_Weekly_Demand': 0, 'Std_Weekly_Demand': 0, 'Avg_Lead_Time'
 service_level = 0.95
 Z = 1.65   # z-score for 95% service level
 
-# Convert lead time to weeks (approx)
-model_df['Lead_Time_Weeks'] = model_df['Avg_Lead_Time'] / 7
-
-# Safety stock = Z * std_demand * sqrt(lead_time_weeks)
-model_df['Safety_Stock'] = Z * model_df['Std_Weekly_Demand'] * np.sqrt(model_df['Lead_Time_Weeks'])
-
-# ROP = demand during lead time + safety stock
-model_df['ROP'] = (model_df['Avg_Weekly_Demand'] * model_df['Lead_Time_Weeks']) + model_df['Safety_Stock']
+# Fused kernel for sections 4 and 5: one pass over the SKU arrays fills every
+# policy column instead of allocating a temporary per pandas expression
+@njit(parallel=True, fastmath=True, cache=True)
+def compute_policy(avg_demand, std_demand, lead_days, Z, S, H,
+                   out_weeks, out_safety, out_rop, out_annual, out_eoq):
+    for i in prange(avg_demand.shape[0]):
+        # Convert lead time to weeks (approx)
+        weeks = lead_days[i] / 7.0
+        # Safety stock = Z * std_demand * sqrt(lead_time_weeks)
+        safety = Z * std_demand[i] * np.sqrt(weeks)
+        # Demand D per year (weekly * 52)
+        annual = avg_demand[i] * 52.0
+        out_weeks[i] = weeks
+        out_safety[i] = safety
+        # ROP = demand during lead time + safety stock
+        out_rop[i] = avg_demand[i] * weeks + safety
+        out_annual[i] = annual
+        # EOQ = sqrt((2 * D * S) / H)
+        out_eoq[i] = np.sqrt((2.0 * annual * S) / H)
 
 # ------------------------------------------------------------
 # 5️⃣ EOQ CALCULATION (ECONOMIC ORDER QUANTITY)
@@ -82,31 +113,43 @@ model_df['ROP'] = (model_df['Avg_Weekly_Demand'] * model_df['Lead_Time_Weeks'])
 ordering_cost = 50
 holding_cost = 2
 
-# Demand D per year (weekly * 52)
-model_df['Annual_Demand'] = model_df['Avg_Weekly_Demand'] * 52
-
-# EOQ = sqrt((2 * D * S) / H)
-model_df['EOQ'] = np.sqrt((2 * model_df['Annual_Demand'] * ordering_cost) / holding_cost)
+policy_cols = ['Lead_Time_Weeks', 'Safety_Stock', 'ROP', 'Annual_Demand', 'EOQ']
+policy = {col: np.empty(len(model_df)) for col in policy_cols}
+compute_policy(
+    model_df['Avg_Weekly_Demand'].to_numpy(np.float64),
+    model_df['Std_Weekly_Demand'].to_numpy(np.float64),
+    model_df['Avg_Lead_Time'].to_numpy(np.float64),
+    Z, ordering_cost, holding_cost,
+    *policy.values(),
+)
+for col in policy_cols:
+    model_df[col] = policy[col]
 
 # ------------------------------------------------------------
 # 6️⃣ ABC CLASSIFICATION ADJUSTMENT (from products)
 # ------------------------------------------------------------
 # If ABC info is in another table, merge it here; else use a proxy
-model_df['ABC_Category'] = pd.qcut(
-    model_df['Annual_Demand'].rank(method='first'), q=3, labels=['C', 'B', 'A']
-)
+# Terciles by annual demand from one stable argsort (ties keep row order, like
+# rank(method='first')); the cut points match pd.qcut over ranks 1..n
+order = np.argsort(model_df['Annual_Demand'].to_numpy(), kind='stable')
+n = len(order)
+c_end, b_end = (n - 1) // 3 + 1, 2 * (n - 1) // 3 + 1
+abc = np.empty(n, dtype='U1')
+abc[order[:c_end]] = 'C'
+abc[order[c_end:b_end]] = 'B'
+abc[order[b_end:]] = 'A'
+model_df['ABC_Category'] = pd.Categorical(abc, categories=['C', 'B', 'A'], ordered=True)
 
 # Adjust safety stock by category priority
 adj = {'A': 1.0, 'B': 0.8, 'C': 0.6}
-model_df['Safety_Stock_Adjusted'] = model_df.apply(
-    lambda x: x['Safety_Stock'] * adj.get(x['ABC_Category'], 1.0), axis=1
+model_df['Safety_Stock_Adjusted'] = (
+    model_df['Safety_Stock'] * model_df['ABC_Category'].astype(str).map(adj).fillna(1.0)
 )
 
 # ------------------------------------------------------------
 # 7️⃣ RECOMMENDED ORDER QUANTITY
 # ------------------------------------------------------------
-# Current inventory per SKU (from inventory_tx)
-current_inv = inventory.groupby('SKU')['Quantity'].sum().reset_index().rename(columns={'Quantity': 'Current_Stock'})
+# Current inventory per SKU (from sku_kpis, loaded in section 2)
 model_df = pd.merge(model_df, current_inv, on='SKU', how='left').fillna({'Current_Stock': 0})
 
 # Recommended order = max(ROP - Current, 0)
@@ -115,9 +158,17 @@ model_df['Recommended_Order_Qty'] = np.maximum(model_df['ROP'] - model_df['Curre
 # ------------------------------------------------------------
 # 8️⃣ VISUALIZATIONS
 # ------------------------------------------------------------
+# One Figure is reused for every plot; each plot clears it and sets its own size,
+# and the pyplot/seaborn calls below draw on its fresh axes
+fig = plt.figure()
+
+def new_plot(figsize):
+    fig.clear()
+    fig.set_size_inches(*figsize)
+    return fig.add_subplot(111)
 
 # --- Safety Stock by SKU ---
-plt.figure(figsize=(10,5))
+new_plot((10, 5))
 sns.barplot(data=model_df.sort_values('Safety_Stock', ascending=False).head(30),
             x='SKU', y='Safety_Stock', hue='ABC_Category', dodge=False)
 plt.title('Top 30 SKUs by Safety Stock')
@@ -125,49 +176,46 @@ plt.xlabel('SKU')
 plt.ylabel('Safety Stock Units')
 plt.xticks(rotation=90)
 plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_DIR, "top30_safety_stock.png"))
-plt.close()
+fig.savefig(os.path.join(OUTPUT_DIR, "top30_safety_stock.png"))
 
 # --- ROP vs Current Inventory ---
-plt.figure(figsize=(8,6))
+new_plot((8, 6))
 sns.scatterplot(data=model_df, x='ROP', y='Current_Stock', hue='ABC_Category', alpha=0.7)
 plt.title("Reorder Point vs Current Inventory")
 plt.xlabel("Reorder Point (ROP)")
 plt.ylabel("Current Stock")
 plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_DIR, "rop_vs_current_stock.png"))
-plt.close()
+fig.savefig(os.path.join(OUTPUT_DIR, "rop_vs_current_stock.png"))
 
 # --- EOQ Distribution by Category (Improved) ---
-plt.figure(figsize=(10,5))
+new_plot((10, 5))
 sns.kdeplot(data=model_df, x='EOQ', hue='ABC_Category', fill=True, common_norm=False, alpha=0.4)
 plt.title("EOQ Distribution by ABC Category")
 plt.xlabel("Economic Order Quantity (EOQ)")
 plt.ylabel("Density")
 plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_DIR, "eoq_distribution_by_category.png"))
-plt.close()
+fig.savefig(os.path.join(OUTPUT_DIR, "eoq_distribution_by_category.png"))
 
 # --- Top 30 SKUs by EOQ (Improved) ---
 top_eoq = model_df.sort_values('EOQ', ascending=False).head(30)
-plt.figure(figsize=(12,6))
+new_plot((12, 6))
 sns.barplot(data=top_eoq, x='SKU', y='EOQ', hue='ABC_Category', dodge=False)
 plt.title("Top 30 SKUs by EOQ")
 plt.xlabel("SKU")
 plt.ylabel("EOQ")
 plt.xticks(rotation=90)
 plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_DIR, "top30_eoq_by_sku.png"))
-plt.close()
+fig.savefig(os.path.join(OUTPUT_DIR, "top30_eoq_by_sku.png"))
 
 # --- Recommended Order Quantities ---
-plt.figure(figsize=(10,5))
+new_plot((10, 5))
 sns.histplot(model_df['Recommended_Order_Qty'], bins=30, color='teal', kde=True)
 plt.title('Distribution of Recommended Order Quantities')
 plt.xlabel('Recommended Order Quantity')
 plt.ylabel('Frequency')
 plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_DIR, "recommended_order_qty_distribution.png"))
-plt.close()
+fig.savefig(os.path.join(OUTPUT_DIR, "recommended_order_qty_distribution.png"))
+
+plt.close(fig)
 
 print("✅ Optimization plots successfully saved in:", OUTPUT_DIR)
@@ -0,0 +1,83 @@
+# ============================================================
+# SKU KPI TABLE (materialized inventory aggregates)
+# - Aggregates inventory_tx.parquet once per SKU and writes sku_kpis.parquet
+# - EDA, modeling, simulation and the dashboard read this small table
+#   instead of re-aggregating the full transaction log on every run
+# - Run after ingestion; it only rebuilds when inventory_tx.parquet is newer
+# - Consumers call ensure_sku_kpis(), which rebuilds a missing or stale table
+#   before they read it
+# ============================================================
+
+import os
+import numpy as np
+import pandas as pd
+
+# -------------------------
+# 1) PATH SETUP
+# -------------------------
+BASE_DIR = os.path.abspath(r"C:\\Users\\hp\\Desktop\\Inventory-Optimization-Project")
+PROCESSED_PATH = os.path.join(BASE_DIR, "data", "processed")
+
+# -------------------------
+# 2) BUILD
+# -------------------------
+def is_stale(processed_path=PROCESSED_PATH):
+    """True if sku_kpis.parquet is missing or older than the inventory transactions."""
+    inventory_file = os.path.join(processed_path, "inventory_tx.parquet")
+    sku_kpis_file = os.path.join(processed_path, "sku_kpis.parquet")
+    if not os.path.exists(inventory_file):
+        raise FileNotFoundError(f"{inventory_file} not found; run src/ingestion/load_data.py first")
+    return (not os.path.exists(sku_kpis_file)
+            or os.path.getmtime(sku_kpis_file) < os.path.getmtime(inventory_file))
+
+def build_sku_kpis(processed_path=PROCESSED_PATH):
+    """Per-SKU stock level and on-hand statistics from the transaction log."""
+    inventory = pd.read_parquet(os.path.join(processed_path, "inventory_tx.parquet"), columns=['SKU', 'Quantity'])
+    # Aggregate over small integer SKU codes: bincount / ufunc.at passes instead of
+    # a hash group-by (codes follow the sorted SKU order, like groupby)
+    codes, skus = pd.factorize(inventory['SKU'], sort=True)
+    qty = inventory['Quantity'].to_numpy()
+    # Null SKUs get code -1; drop them like groupby does
+    valid = codes >= 0
+    codes, qty = codes[valid], qty[valid]
+    k = len(skus)
+    count = np.bincount(codes, minlength=k)
+    total = np.bincount(codes, weights=qty, minlength=k)
+    mean = total / count
+    dev = qty - mean[codes]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(np.bincount(codes, weights=dev * dev, minlength=k) / (count - 1))
+    # initial=0 keeps an empty table (no SKUs left) from raising; every SKU has
+    # at least one row, so the fill value is always overwritten
+    mins = np.full(k, qty.max(initial=0), dtype=qty.dtype)
+    np.minimum.at(mins, codes, qty)
+    maxs = np.full(k, qty.min(initial=0), dtype=qty.dtype)
+    np.maximum.at(maxs, codes, qty)
+
+    # Explicit string categories keep the SKU column's Parquet type even when
+    # no SKUs are left
+    names = pd.Index(skus, dtype=str)
+    sku_kpis = pd.DataFrame({
+        'SKU': pd.Categorical(names, categories=names),
+        'Current_Stock': total.astype(qty.dtype),
+        'Avg_On_Hand': mean,
+        'Std_On_Hand': std,
+        'Min_On_Hand': mins,
+        'Max_On_Hand': maxs,
+    })
+    sku_kpis.to_parquet(os.path.join(processed_path, "sku_kpis.parquet"), engine="pyarrow", compression="snappy", index=False)
+    return sku_kpis
+
+def ensure_sku_kpis(processed_path=PROCESSED_PATH):
+    """Path to an up-to-date sku_kpis.parquet, (re)building it first if missing or stale."""
+    if is_stale(processed_path):
+        sku_kpis = build_sku_kpis(processed_path)
+        print(f"📁 Saved sku_kpis.parquet: {len(sku_kpis)} SKUs")
+    return os.path.join(processed_path, "sku_kpis.parquet")
+
+if __name__ == "__main__":
+    if is_stale():
+        sku_kpis = build_sku_kpis()
+        print(f"📁 Saved sku_kpis.parquet: {len(sku_kpis)} SKUs")
+    else:
+        print("✔️ sku_kpis.parquet is up to date")
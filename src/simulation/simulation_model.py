@@ -1,16 +1,19 @@
 # ============================================================
 # STEP 4: SIMULATION & WHAT-IF ANALYSIS (robust, no CSV dependency)
-# - Rebuilds model inputs from processed data (sales, products, suppliers, inventory, purchase_orders)
+# - Rebuilds model inputs from processed data (sales, products, suppliers, sku_kpis, purchase_orders)
+#   and caches them in data/processed/sim_model_inputs.parquet
 # - Runs three scenarios (demand surge, lead-time delay, cost variation)
 # - Saves only PNG visual outputs
 # ============================================================
 
 import os
+import sys
 import numpy as np
 import pandas as pd
+import polars as pl
 import matplotlib.pyplot as plt
 import seaborn as sns
-from tqdm import tqdm
+from numba import njit, prange, vectorize
 
 # -------------------------
 # 1) PATH SETUP
@@ -20,203 +23,314 @@ PROCESSED_PATH = os.path.join(BASE_DIR, "data", "processed")
 OUTPUT_PATH = os.path.join(BASE_DIR, "dashboards", "simulation_results")
 os.makedirs(OUTPUT_PATH, exist_ok=True)
 
+# Shared sku_kpis builder: consumers rebuild the table when it is missing or stale
+sys.path.append(os.path.join(BASE_DIR, "src", "reporting"))
+from build_sku_kpis import ensure_sku_kpis
+
+# Cached model_df (step 3), rebuilt whenever any of the processed source tables is newer,
+# or this script is (so an edit to build_model_df() never reuses the old inputs)
+MODEL_INPUTS_FILE = os.path.join(PROCESSED_PATH, "sim_model_inputs.parquet")
+SOURCE_FILES = [os.path.join(PROCESSED_PATH, f) for f in
+                ("products.parquet", "suppliers.parquet", "sales.parquet", "purchase_orders.parquet",
+                 "inventory_tx.parquet", "sku_kpis.parquet")] + [os.path.abspath(__file__)]
+
 print("Simulation outputs will be saved to:", OUTPUT_PATH)
 
 # -------------------------
-# 2) LOAD PROCESSED DATA
+# 2) MODEL INPUTS
 # -------------------------
-# These should exist from Step 1 processed data
-products = pd.read_csv(os.path.join(PROCESSED_PATH, "products.csv"))
-suppliers = pd.read_csv(os.path.join(PROCESSED_PATH, "suppliers.csv"))
-sales = pd.read_csv(os.path.join(PROCESSED_PATH, "sales.csv"))
-inventory = pd.read_csv(os.path.join(PROCESSED_PATH, "inventory_tx.csv"))
-purchase_orders = pd.read_csv(os.path.join(PROCESSED_PATH, "purchase_orders.csv"))
+# Safety stock service level, shared by the policy math and the lead-time scenario
+Z = 1.65  # ~95%
+NS_PER_DAY = 86_400_000_000_000
 
-# -------------------------
-# 3) PREPARE MODEL INPUTS
-# -------------------------
-# Convert date columns if present
-if "Sale_Date" in sales.columns:
-    sales['Sale_Date'] = pd.to_datetime(sales['Sale_Date'])
-
-if "Order_Date" in purchase_orders.columns:
-    purchase_orders['Order_Date'] = pd.to_datetime(purchase_orders['Order_Date'])
-if "Delivery_Date" in purchase_orders.columns:
-    purchase_orders['Delivery_Date'] = pd.to_datetime(purchase_orders['Delivery_Date'])
-
-# 3.1 Weekly demand stats per SKU
-sales['Week'] = sales['Sale_Date'].dt.to_period('W') if 'Sale_Date' in sales.columns else None
-if sales['Week'].isnull().all():
-    # fallback: aggregate by day if week can't be computed
-    sku_weekly = sales.groupby('SKU')['Quantity_Sold'].sum().reset_index().rename(columns={'Quantity_Sold': 'Quantity'})
-    sku_weekly['Week'] = 0
-    sku_weekly = sku_weekly.groupby(['SKU','Week'])['Quantity'].sum().reset_index()
-else:
-    sku_weekly = sales.groupby(['SKU', 'Week'])['Quantity_Sold'].sum().reset_index()
+def model_inputs_stale():
+    """True if the cached model inputs are missing or older than any processed input or this script."""
+    if not os.path.exists(MODEL_INPUTS_FILE):
+        return True
+    cached = os.path.getmtime(MODEL_INPUTS_FILE)
+    return any(os.path.getmtime(f) > cached for f in SOURCE_FILES)
+
+def build_model_df():
+    """Per-SKU demand, lead time, stock, costs, EOQ/safety stock/ROP and ABC class."""
+    # Load processed data (from Step 1): lazy Polars scans; Parquet keeps the dates as datetime64
+    products = pl.scan_parquet(os.path.join(PROCESSED_PATH, "products.parquet"))
+    suppliers = pl.scan_parquet(os.path.join(PROCESSED_PATH, "suppliers.parquet"))
+    sales = pl.scan_parquet(os.path.join(PROCESSED_PATH, "sales.parquet"))
+    purchase_orders = pl.scan_parquet(os.path.join(PROCESSED_PATH, "purchase_orders.parquet"))
 
-sku_demand_stats = sku_weekly.groupby('SKU')['Quantity_Sold'].agg(['mean', 'std']).reset_index().rename(
-    columns={'mean': 'Avg_Weekly_Demand', 'std': 'Std_Weekly_Demand'}
-)
+    # Per-SKU inventory aggregates (sku_kpis.parquet, refreshed in step 3 before this runs)
+    current_inv = pl.scan_parquet(os.path.join(PROCESSED_PATH, "sku_kpis.parquet")).select(['SKU', 'Current_Stock'])
 
-# 3.2 Supplier lead time: prefer purchase_orders (actual), else suppliers table
-if {'Order_Date', 'Delivery_Date'}.issubset(purchase_orders.columns):
-    purchase_orders['Lead_Time_Days'] = (purchase_orders['Delivery_Date'] - purchase_orders['Order_Date']).dt.days
-    supplier_lead = purchase_orders.groupby('Supplier_ID')['Lead_Time_Days'].mean().reset_index().rename(
-        columns={'Lead_Time_Days': 'Avg_Lead_Time_Days'}
+    # The group-bys, joins and default fills are one lazy Polars plan, converted to
+    # pandas once before the EOQ / safety stock / ROP math.
+    products_cols = products.collect_schema().names()
+    sales_cols = sales.collect_schema().names()
+    po_cols = purchase_orders.collect_schema().names()
+    suppliers_cols = suppliers.collect_schema().names()
+
+    # Weekly demand stats per SKU
+    # Week as a plain integer key (Monday-based week number) rather than a calendar period;
+    # 1970-01-01 was a Thursday, so shifting by 3 days gives Monday-Sunday weeks
+    if 'Sale_Date' in sales_cols:
+        week = (pl.col('Sale_Date').cast(pl.Date).cast(pl.Int32) + 3) // 7
+    else:
+        # fallback: one bucket per SKU if week can't be computed
+        week = pl.lit(0)
+
+    sku_demand_stats = (
+        sales.group_by(['SKU', week.alias('Week')])
+        .agg(pl.col('Quantity_Sold').cast(pl.Int64).sum())
+        .group_by('SKU')
+        .agg([
+            pl.col('Quantity_Sold').mean().alias('Avg_Weekly_Demand'),
+            pl.col('Quantity_Sold').std().alias('Std_Weekly_Demand'),
+        ])
     )
-else:
-    # fallback to suppliers table column names
-    if 'Lead_Time_Days_Avg' in suppliers.columns:
-        supplier_lead = suppliers[['Supplier_ID', 'Lead_Time_Days_Avg']].rename(
-            columns={'Lead_Time_Days_Avg': 'Avg_Lead_Time_Days'}
+
+    # Supplier lead time: prefer purchase_orders (actual), else suppliers table
+    if {'Order_Date', 'Delivery_Date'}.issubset(po_cols):
+        # Whole days as one int64 subtraction on the raw datetime64[ns] values, no Duration type
+        lead_time_days = (pl.col('Delivery_Date').cast(pl.Int64) - pl.col('Order_Date').cast(pl.Int64)) // NS_PER_DAY
+        supplier_lead = (
+            purchase_orders.with_columns(lead_time_days.alias('Lead_Time_Days'))
+            .group_by('Supplier_ID')
+            .agg(pl.col('Lead_Time_Days').mean().alias('Avg_Lead_Time_Days'))
         )
     else:
-        supplier_lead = suppliers[['Supplier_ID']].copy()
-        supplier_lead['Avg_Lead_Time_Days'] = 14  # default
-
-# 3.3 Merge product-level info with demand and supplier lead times
-# Ensure products has Supplier_ID and cost/order/holding fields (use defaults if missing)
-if 'Ordering_Cost' not in products.columns:
-    products['Ordering_Cost'] = 50
-if 'Holding_Cost_Per_Unit_Per_Year' not in products.columns:
-    # convert to weekly holding cost (per unit per week) later if needed
-    products['Holding_Cost_Per_Unit_Per_Year'] = 2 * 52  # set a reasonable default annual cost -> weekly will be 2
-
-model_df = products[['SKU', 'Supplier_ID', 'Unit_Cost', 'Ordering_Cost', 'Holding_Cost_Per_Unit_Per_Year']].copy()
-model_df = model_df.merge(sku_demand_stats, on='SKU', how='left')
-model_df = model_df.merge(supplier_lead, on='Supplier_ID', how='left')
-
-# Fill NA defaults
-model_df['Avg_Weekly_Demand'] = model_df['Avg_Weekly_Demand'].fillna(0)
-model_df['Std_Weekly_Demand'] = model_df['Std_Weekly_Demand'].fillna(0)
-model_df['Avg_Lead_Time_Days'] = model_df['Avg_Lead_Time_Days'].fillna(14)  # default two weeks
-
-# Convert lead time to weeks
-model_df['Avg_Lead_Time_Weeks'] = model_df['Avg_Lead_Time_Days'] / 7.0
-
-# Current inventory per SKU (sum of inventory transactions)
-if 'Quantity' in inventory.columns:
-    current_inv = inventory.groupby('SKU')['Quantity'].sum().reset_index().rename(columns={'Quantity': 'Current_Stock'})
-else:
-    current_inv = pd.DataFrame({'SKU': model_df['SKU'], 'Current_Stock': 0})
+        # fallback to suppliers table column names
+        if 'Lead_Time_Days_Avg' in suppliers_cols:
+            supplier_lead = suppliers.select(['Supplier_ID', pl.col('Lead_Time_Days_Avg').alias('Avg_Lead_Time_Days')])
+        else:
+            supplier_lead = suppliers.select(['Supplier_ID', pl.lit(14.0).alias('Avg_Lead_Time_Days')])  # default
 
-model_df = model_df.merge(current_inv, on='SKU', how='left')
-model_df['Current_Stock'] = model_df['Current_Stock'].fillna(0)
+    # Merge product-level info with demand and supplier lead times
+    # Ensure products has Supplier_ID and cost/order/holding fields (use defaults if missing)
+    if 'Ordering_Cost' not in products_cols:
+        products = products.with_columns(pl.lit(50).alias('Ordering_Cost'))
+    if 'Holding_Cost_Per_Unit_Per_Year' not in products_cols:
+        # convert to weekly holding cost (per unit per week) later if needed
+        products = products.with_columns(pl.lit(2 * 52).alias('Holding_Cost_Per_Unit_Per_Year'))  # set a reasonable default annual cost -> weekly will be 2
 
-# -------------------------
-# 4) CALCULATE EOQ, SAFETY STOCK, ROP
-# -------------------------
-# EOQ: use ordering cost S and holding cost H (annual)
-# If Holding_Cost_Per_Unit_Per_Year is present use it; else derive approx
-model_df['Annual_Demand'] = model_df['Avg_Weekly_Demand'] * 52
+    model_lf = (
+        products.select(['SKU', 'Supplier_ID', 'Unit_Cost', 'Ordering_Cost', 'Holding_Cost_Per_Unit_Per_Year'])
+        .join(sku_demand_stats, on='SKU', how='left', maintain_order='left')
+        .join(supplier_lead, on='Supplier_ID', how='left', maintain_order='left')
+        # Fill NA defaults
+        .with_columns([
+            pl.col('Avg_Weekly_Demand').fill_null(0),
+            pl.col('Std_Weekly_Demand').fill_null(0),
+            pl.col('Avg_Lead_Time_Days').fill_null(14),  # default two weeks
+        ])
+        # Convert lead time to weeks
+        .with_columns((pl.col('Avg_Lead_Time_Days') / 7.0).alias('Avg_Lead_Time_Weeks'))
+        # Current inventory per SKU (sum of inventory transactions, from sku_kpis)
+        .join(current_inv, on='SKU', how='left', maintain_order='left')
+        .with_columns(pl.col('Current_Stock').fill_null(0))
+    )
+    model_df = model_lf.collect().to_pandas()
 
-# Set parameters and safe defaults
-model_df['Ordering_Cost'] = model_df['Ordering_Cost'].fillna(50)
-model_df['Holding_Cost_Per_Unit_Per_Year'] = model_df['Holding_Cost_Per_Unit_Per_Year'].fillna(2 * 52)
+    # EOQ, safety stock & ROP
+    # Set parameters and safe defaults
+    model_df['Ordering_Cost'] = model_df['Ordering_Cost'].fillna(50)
+    model_df['Holding_Cost_Per_Unit_Per_Year'] = model_df['Holding_Cost_Per_Unit_Per_Year'].fillna(2 * 52)
 
-# EOQ formula (avoid zero division)
-model_df['EOQ'] = np.sqrt((2 * model_df['Annual_Demand'] * model_df['Ordering_Cost']) / model_df['Holding_Cost_Per_Unit_Per_Year'])
-model_df['EOQ'] = model_df['EOQ'].replace([np.inf, -np.inf], 0).fillna(0)
+    # The policy math runs on raw float32 arrays (the same width ingestion stores floats
+    # in) and is written back with a single assign, instead of one pandas Series per step
+    f32 = np.float32
+    avg_weekly = model_df['Avg_Weekly_Demand'].to_numpy(f32)
+    std_weekly = model_df['Std_Weekly_Demand'].to_numpy(f32)
+    lead_weeks = model_df['Avg_Lead_Time_Weeks'].to_numpy(f32)
+    S = model_df['Ordering_Cost'].to_numpy(f32)
+    H = model_df['Holding_Cost_Per_Unit_Per_Year'].to_numpy(f32)
 
-# Safety stock & ROP: choose service level
-Z = 1.65  # ~95%
-model_df['Demand_SD_LeadTime'] = model_df['Std_Weekly_Demand'] * np.sqrt(model_df['Avg_Lead_Time_Weeks'].replace(0, 1e-6))
-model_df['Safety_Stock'] = Z * model_df['Demand_SD_LeadTime']
-model_df['Demand_During_Lead'] = model_df['Avg_Weekly_Demand'] * model_df['Avg_Lead_Time_Weeks']
-model_df['ROP'] = model_df['Demand_During_Lead'] + model_df['Safety_Stock']
+    # Annual demand D = weekly * 52; EOQ = sqrt(2 * D * S / H), 0 where undefined
+    annual = avg_weekly * f32(52)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eoq = np.sqrt(f32(2) * annual * S / H)
+    eoq[~np.isfinite(eoq)] = 0
+    # Safety stock = Z * std * sqrt(lead weeks); ROP = demand during lead time + safety stock
+    sd_lead = std_weekly * np.sqrt(np.where(lead_weeks == 0, f32(1e-6), lead_weeks))
+    safety = f32(Z) * sd_lead
+    during_lead = avg_weekly * lead_weeks
+    model_df = model_df.assign(
+        Annual_Demand=annual,
+        EOQ=eoq,
+        Demand_SD_LeadTime=sd_lead,
+        Safety_Stock=safety,
+        Demand_During_Lead=during_lead,
+        ROP=during_lead + safety,
+    )
+
+    # Add ABC proxy if not available (top terciles by annual demand)
+    # Ranks from one stable argsort (ties keep row order, like rank(method='first')),
+    # bucketed with searchsorted at the same cut points pd.qcut uses over ranks 1..n
+    n = len(annual)
+    ranks = np.empty(n, dtype=np.intp)
+    ranks[np.argsort(annual, kind='stable')] = np.arange(n)
+    cuts = [(n - 1) // 3 + 1, 2 * (n - 1) // 3 + 1]
+    model_df['ABC_Category'] = pd.Categorical.from_codes(np.searchsorted(cuts, ranks, side='right'),
+                                                         categories=['C', 'B', 'A'], ordered=True)
 
-# Add ABC proxy if not available (top terciles by annual demand)
-model_df['ABC_Category'] = pd.qcut(model_df['Annual_Demand'].rank(method='first'), q=3, labels=['C','B','A'])
+    return model_df
 
 # -------------------------
-# 5) HELPER FUNCTIONS FOR SIMULATION
+# 3) LOAD OR BUILD MODEL INPUTS
 # -------------------------
-def simulate_demand_once(base_weekly, surge_factor):
-    """Return a simulated weekly demand value (normal around base)."""
-    if base_weekly == 0:
+# model_df depends only on the processed data, so it is cached as Parquet and rebuilt
+# only when one of the source tables changes. sku_kpis is refreshed first: a rebuilt
+# table is newer than the cache, so stale Current_Stock never survives a cache hit.
+ensure_sku_kpis(PROCESSED_PATH)
+if model_inputs_stale():
+    model_df = build_model_df()
+    model_df.to_parquet(MODEL_INPUTS_FILE, engine="pyarrow", compression="snappy", index=False)
+    print("📁 Saved model inputs:", MODEL_INPUTS_FILE)
+else:
+    model_df = pd.read_parquet(MODEL_INPUTS_FILE)
+    print("✔️ Using cached model inputs:", MODEL_INPUTS_FILE)
+
+# -------------------------
+# 4) SIMULATION KERNELS
+# -------------------------
+# Per-SKU draw models as NumPy ufuncs: apply element-wise over whole arrays, and
+# are called as scalar functions inside the kernels below.
+@vectorize(['float64(float64, float64, float64, float64, float64)'], cache=True)
+def simulate_demand_once(base_weekly, surge_scale, uni, nrm, sd):
+    """Simulated weekly demand (normal around the surged base, floored at 0)."""
+    if base_weekly == 0.0:
         return 0.0
-    sd = max(base_weekly * 0.3, 1.0)  # baseline variability if std not reliable
-    return max(0.0, np.random.normal(loc=base_weekly * (1 + surge_factor * np.random.uniform(-0.2, 1.0)), scale=sd))
-
-def simulate_leadtime_once(base_days, delay_factor):
-    """Return simulated lead time in days (base +/- noise)."""
-    if np.isnan(base_days) or base_days <= 0:
-        base_days = 14
-    sd = max(base_days * 0.3, 1.0)
-    return max(1.0, np.random.normal(loc=base_days * (1 + delay_factor * np.random.uniform(0.0, 1.0)), scale=sd))
-
-def total_cost_for_sku(eoq, annual_demand, ordering_cost, holding_cost_annual):
-    """Simple total annual cost: ordering + holding."""
-    if eoq <= 0 or annual_demand <= 0:
-        return np.nan
-    orders_per_year = annual_demand / eoq
-    return orders_per_year * ordering_cost + (holding_cost_annual * eoq / 2.0)
+    return max(0.0, base_weekly + surge_scale * uni + sd * nrm)
+
+@vectorize(['float64(float64, float64, float64, float64, float64)'], cache=True)
+def simulate_leadtime_once(base_days, delay_scale, uni, nrm, sd):
+    """Simulated lead time in days (normal around the delayed base, at least 1)."""
+    return max(1.0, base_days + delay_scale * uni + sd * nrm)
+
+# One thread per run (prange); each kernel fuses the per-SKU transform, test and
+# reduction, so no (runs, N) intermediates are materialized. Random inputs are
+# drawn outside by the caller's Generator: uni ~ U(low, high), nrm ~ N(0, 1).
+@njit(parallel=True, fastmath=True, cache=True)
+def surge_kernel(base, sd, surge_scale, threshold, uni, nrm, n_total, fixed_stockouts, out_probs):
+    runs, n = uni.shape
+    for r in prange(runs):
+        stockouts = fixed_stockouts
+        for i in range(n):
+            if simulate_demand_once(base[i], surge_scale[i], uni[r, i], nrm[r, i], sd[i]) > threshold[i]:
+                stockouts += 1
+        out_probs[r] = stockouts / n_total
+
+@njit(parallel=True, fastmath=True, cache=True)
+def leadtime_kernel(base_lead, lead_sd, delay_scale, safety_scale, uni, nrm, n_total, out_safety):
+    runs, n = uni.shape
+    for r in prange(runs):
+        total = 0.0
+        for i in range(n):
+            lead_days = simulate_leadtime_once(base_lead[i], delay_scale[i], uni[r, i], nrm[r, i], lead_sd[i])
+            total += safety_scale[i] * np.sqrt(lead_days)
+        out_safety[r] = total / n_total
+
+@njit(parallel=True, fastmath=True, cache=True)
+def cost_kernel(valid, ordering_term, holding_term, mult, out_costs):
+    runs, n = mult.shape
+    for r in prange(runs):
+        total = 0.0
+        count = 0
+        for i in range(n):
+            if valid[i]:
+                total += ordering_term[i] + holding_term[i] * mult[r, i]
+                count += 1
+        out_costs[r] = total / count if count > 0 else np.nan
 
 # -------------------------
-# 6) SIMULATION SCENARIOS
+# 5) SIMULATION ENGINE
 # -------------------------
-def simulate_demand_surge(df, surge_factor=0.3, runs=500):
-    """Monte Carlo: random demand surges for A SKUs and compute stockout rate per run."""
-    results = []
-    df = df.copy()
-    for _ in tqdm(range(runs), desc="Demand Surge sims"):
-        # Simulate demand for each SKU
-        df['Sim_Weekly_Demand'] = df['Avg_Weekly_Demand'].apply(lambda x: simulate_demand_once(x, surge_factor))
-        # Simple rule: stockout if Sim_Weekly_Demand > (Current_Stock + EOQ) (very simplified)
-        df['Stockout_Flag'] = np.where(df['Sim_Weekly_Demand'] > (df['Current_Stock'] + df['EOQ']), 1, 0)
-        results.append(df['Stockout_Flag'].mean())
-    # Plot distribution of stockout probabilities
-    plt.figure(figsize=(8,4))
-    sns.histplot(results, bins=30, kde=True, color='orange')
-    plt.title("Stockout Probability Distribution (Demand Surge)")
-    plt.xlabel("Stockout Probability")
-    plt.ylabel("Frequency")
-    plt.tight_layout()
-    out = os.path.join(OUTPUT_PATH, "demand_surge_simulation.png")
-    plt.savefig(out, dpi=150)
-    plt.close()
-    print("Saved:", out)
+def run_simulations(df, runs=500, surge_factor=0.3, delay_factor=0.3, cost_factor=0.1, seed=None):
+    """Monte Carlo for all three scenarios at once over (runs, N) random draws.
 
-def simulate_leadtime_delay(df, delay_factor=0.3, runs=500):
-    """Monte Carlo: random lead-time delays and measure average required safety stock."""
-    avg_extra = []
-    df = df.copy()
-    for _ in tqdm(range(runs), desc="Lead Time Delay sims"):
-        df['Sim_Lead_Days'] = df['Avg_Lead_Time_Days'].apply(lambda x: simulate_leadtime_once(x, delay_factor))
-        df['Sim_Lead_Weeks'] = df['Sim_Lead_Days'] / 7.0
-        df['New_Safety'] = Z * df['Std_Weekly_Demand'] * np.sqrt(df['Sim_Lead_Weeks'].replace(0,1e-6))
-        avg_extra.append(df['New_Safety'].mean())
-    plt.figure(figsize=(8,4))
-    sns.histplot(avg_extra, bins=30, kde=True, color='steelblue')
-    plt.title("Average Safety Stock Required under Lead Time Delays")
-    plt.xlabel("Avg Safety Stock Units")
-    plt.ylabel("Frequency")
-    plt.tight_layout()
-    out = os.path.join(OUTPUT_PATH, "lead_time_delay_simulation.png")
-    plt.savefig(out, dpi=150)
-    plt.close()
-    print("Saved:", out)
+    Returns the per-run stockout probability (demand surge), average required
+    safety stock (lead-time delay) and average total annual cost (cost variation).
+    """
+    # SFC64 is the fastest NumPy bit generator per variate; SeedSequence turns any
+    # seed (or None, for fresh OS entropy) into well-mixed state
+    rng = np.random.Generator(np.random.SFC64(np.random.SeedSequence(seed)))
+    n_total = len(df)
 
-def simulate_cost_variation(df, cost_factor=0.1, runs=500):
-    """Monte Carlo: vary unit cost and compute average total annual cost."""
-    avg_costs = []
-    df = df.copy()
-    for _ in tqdm(range(runs), desc="Cost Variation sims"):
-        df['Sim_Unit_Cost'] = df['Unit_Cost'] * np.random.uniform(1-cost_factor, 1+cost_factor, size=len(df))
-        df['Sim_Total_Cost'] = df.apply(lambda r: total_cost_for_sku(
-            eoq=r['EOQ'],
-            annual_demand=r['Annual_Demand'],
-            ordering_cost=r['Ordering_Cost'],
-            holding_cost_annual=r['Holding_Cost_Per_Unit_Per_Year']
-        ), axis=1)
-        avg_costs.append(df['Sim_Total_Cost'].mean())
+    # Dead SKUs (no demand at all) always simulate to 0 demand, 0 safety stock and no
+    # cost, so they are masked out of the draws. Averages still divide by all SKUs, and
+    # their fixed stockouts (0 demand > a negative Current_Stock + EOQ) are added back.
+    dead = ((df['Avg_Weekly_Demand'] == 0) & (df['Std_Weekly_Demand'] == 0)).to_numpy()
+    fixed_stockouts = int(np.count_nonzero((df['Current_Stock'] + df['EOQ']).to_numpy()[dead] < 0))
+    if dead.any():
+        print(f"Skipping {dead.sum()} dead SKUs (zero demand) in the simulations")
+    active = df.loc[~dead]
+    n = len(active)
+
+    # Draw buffers shared by all three scenarios; every draw refills them in place (out=)
+    # as one bulk (runs, N) call instead of allocating fresh arrays per scenario
+    uni = np.empty((runs, n))
+    nrm = np.empty((runs, n))
+
+    def fill_uniform(low, high):
+        u = rng.random(out=uni)
+        u *= high - low
+        u += low
+        return u
+
+    # SKU inputs, extracted once
+    base_demand = active['Avg_Weekly_Demand'].to_numpy(dtype=np.float64)
+    base_lead = active['Avg_Lead_Time_Days'].to_numpy(dtype=np.float64)
+    std_weekly = active['Std_Weekly_Demand'].to_numpy(dtype=np.float64)
+    eoq = active['EOQ'].to_numpy(dtype=np.float64)
+    current_stock = active['Current_Stock'].to_numpy(dtype=np.float64)
+    annual_demand = active['Annual_Demand'].to_numpy(dtype=np.float64)
+    ordering_cost = active['Ordering_Cost'].to_numpy(dtype=np.float64)
+    holding_cost = active['Holding_Cost_Per_Unit_Per_Year'].to_numpy(dtype=np.float64)
+
+    # Demand surge: weekly demand ~ N(base * (1 + surge_factor * U(-0.2, 1)), max(0.3 * base, 1)), floored at 0
+    # Per-SKU terms are loop invariants: compute them once, outside the (runs, N) math
+    demand_sd = np.maximum(base_demand * 0.3, 1.0)
+    surge_scale = base_demand * surge_factor
+    # Simple rule: stockout if simulated demand > (Current_Stock + EOQ) (very simplified)
+    stockout_threshold = current_stock + eoq
+    stockout_probs = np.empty(runs)
+    surge_kernel(base_demand, demand_sd, surge_scale, stockout_threshold,
+                 fill_uniform(-0.2, 1.0), rng.standard_normal(out=nrm), n_total, fixed_stockouts, stockout_probs)
+
+    # Lead-time delay: lead days ~ N(base * (1 + delay_factor * U(0, 1)), max(0.3 * base, 1)), at least 1 day
+    base_lead = np.where(np.isnan(base_lead) | (base_lead <= 0), 14.0, base_lead)
+    lead_sd = np.maximum(base_lead * 0.3, 1.0)
+    delay_scale = base_lead * delay_factor
+    # Safety stock = Z * std_weekly * sqrt(lead_days / 7); everything but the lead days is fixed per SKU
+    safety_scale = Z * std_weekly / np.sqrt(7.0)
+    avg_safety = np.empty(runs)
+    leadtime_kernel(base_lead, lead_sd, delay_scale, safety_scale,
+                    fill_uniform(0.0, 1.0), rng.standard_normal(out=nrm), n_total, avg_safety)
+
+    # Cost variation: unit cost scaled by U(1 - cost_factor, 1 + cost_factor) per SKU and run.
+    # Total annual cost = ordering + holding at the planned EOQ; SKUs without EOQ or demand are left out.
+    # Only holding cost is carried on the unit value, so the ordering term is the same in every run
+    # and the holding term just scales with the unit-cost multiplier (Sim_Unit_Cost / Unit_Cost).
+    valid = (eoq > 0) & (annual_demand > 0)
+    orders_per_year = np.divide(annual_demand, eoq, out=np.zeros(n), where=valid)
+    ordering_term = orders_per_year * ordering_cost
+    holding_term = holding_cost * eoq / 2.0
+    avg_costs = np.empty(runs)
+    cost_kernel(valid, ordering_term, holding_term,
+                fill_uniform(1 - cost_factor, 1 + cost_factor), avg_costs)
+
+    return stockout_probs, avg_safety, avg_costs
+
+# -------------------------
+# 6) PLOTTING
+# -------------------------
+def plot_hist(values, title, xlabel, file_name, color):
+    """Histogram + KDE of per-run simulation results, saved as a PNG in OUTPUT_PATH."""
     plt.figure(figsize=(8,4))
-    sns.histplot(avg_costs, bins=30, kde=True, color='green')
-    plt.title("Average Annual Total Cost under Unit Cost Variation")
-    plt.xlabel("Average Annual Cost")
+    sns.histplot(values, bins=30, kde=True, color=color)
+    plt.title(title)
+    plt.xlabel(xlabel)
     plt.ylabel("Frequency")
     plt.tight_layout()
-    out = os.path.join(OUTPUT_PATH, "cost_variation_simulation.png")
+    out = os.path.join(OUTPUT_PATH, file_name)
     plt.savefig(out, dpi=150)
     plt.close()
     print("Saved:", out)
@@ -224,6 +338,8 @@ def simulate_cost_variation(df, cost_factor=0.1, runs=500):
 # -------------------------
 # 7) RUN SIMULATIONS
 # -------------------------
+SEED = 42  # fixed so re-runs reproduce the same PNGs; use None for fresh draws
+
 if __name__ == "__main__":
     # Check model_df for required columns
     required_cols = ['SKU', 'Avg_Weekly_Demand', 'Std_Weekly_Demand', 'Avg_Lead_Time_Days',
@@ -235,7 +351,7 @@ if __name__ == "__main__":
         # Attempt to add defaults
         for c in missing:
             if c == 'Unit_Cost':
-                model_df[c] = products.get('Unit_Cost', 1).fillna(1)
+                model_df[c] = 1
             elif c == 'Ordering_Cost':
                 model_df[c] = model_df.get('Ordering_Cost', 50)
             elif c == 'Holding_Cost_Per_Unit_Per_Year':
@@ -244,8 +360,15 @@ if __name__ == "__main__":
                 model_df[c] = 0
 
     # Run scenarios
-    simulate_demand_surge(model_df, surge_factor=0.3, runs=300)
-    simulate_leadtime_delay(model_df, delay_factor=0.3, runs=300)
-    simulate_cost_variation(model_df, cost_factor=0.1, runs=300)
+    stockout_probs, avg_safety, avg_costs = run_simulations(
+        model_df, runs=300, surge_factor=0.3, delay_factor=0.3, cost_factor=0.1, seed=SEED)
+
+    # Plot distributions of the per-run results
+    plot_hist(stockout_probs, "Stockout Probability Distribution (Demand Surge)",
+              "Stockout Probability", "demand_surge_simulation.png", 'orange')
+    plot_hist(avg_safety, "Average Safety Stock Required under Lead Time Delays",
+              "Avg Safety Stock Units", "lead_time_delay_simulation.png", 'steelblue')
+    plot_hist(avg_costs, "Average Annual Total Cost under Unit Cost Variation",
+              "Average Annual Cost", "cost_variation_simulation.png", 'green')
 
     print("✅ All simulations complete. Check PNGs in:", OUTPUT_PATH)